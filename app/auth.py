@@ -3,7 +3,7 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from .models import User
-from .storage import load_users, save_users
+from .storage import load_users, save_users, users_lock
 from .utils import hash_password, verify_password
 
 SECRET_KEY = "super-secret"
@@ -36,19 +36,21 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
 
 @router.post("/register")
 def register(form: OAuth2PasswordRequestForm = Depends()):
-    users = load_users()
-    if any(u["username"] == form.username for u in users):
-        raise HTTPException(status_code=400, detail="Username exists")
-    
     # 使用 User 模型创建新用户，自动生成 UUID
     new_user = User(
         username=form.username,
         password_hash=hash_password(form.password),
         role="user"
     )
-    
-    users.append(new_user.dict())
-    save_users(users)
+
+    # 多进程部署时在文件锁内完成 读取→检查→保存
+    with users_lock():
+        users = load_users()
+        if any(u["username"] == form.username for u in users):
+            raise HTTPException(status_code=400, detail="Username exists")
+
+        users.append(new_user.dict())
+        save_users(users)
     return {"msg": "Registered", "user_id": new_user.id}
 
 
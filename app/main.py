@@ -1,7 +1,10 @@
 from fastapi import FastAPI
-from . import auth, task_routes
+from . import auth, storage, task_routes
 from fastapi.middleware.cors import CORSMiddleware
 
+# 分片模式下校验分片布局，与 TASK_SHARD_DIRS 不一致时拒绝启动
+storage.check_shard_layout()
+
 app = FastAPI()
 
 # 配置 CORS 中间件
@@ -0,0 +1,51 @@
+"""
+将单机模式下的 data/tasks.json 按 user_id 拆分到 TASK_SHARD_DIRS 指定的各个分片中，
+并为“为他人创建的任务”建立创建者索引。
+
+用法：
+    TASK_SHARD_DIRS=shards/0,shards/1,shards/2 python -m app.migrate_shards
+
+任一分片中已存在 tasks.json 时拒绝执行，避免覆盖分片模式下已写入的任务。
+迁移成功后源文件重命名为 tasks.json.migrated，防止关闭分片模式后读到过期数据。
+"""
+import sys
+
+from . import storage
+
+
+def migrate_to_shards() -> int:
+    if not storage.SHARD_DIRS:
+        raise RuntimeError("TASK_SHARD_DIRS is not set.")
+    storage.check_shard_layout()
+
+    # 同时持有单机模式 tasks.json 的锁，防止仍在运行的单机服务在拆分期间写入
+    with storage._file_lock(storage.TASKS_FILE), storage.tasks_lock():
+        shard_count = len(storage.SHARD_DIRS)
+        existing = [str(storage.shard_tasks_file(i)) for i in range(shard_count) if storage.shard_tasks_file(i).exists()]
+        if existing:
+            raise RuntimeError(f"Shard task files already exist, refusing to overwrite: {existing}")
+
+        tasks = storage._read_json_file(storage.TASKS_FILE)
+        user_ids = {u["username"]: u["id"] for u in storage.load_users()}
+        owner_indexes = [{} for _ in range(shard_count)]
+        for task in tasks:
+            owner_id = user_ids.get(task.get("owner"))
+            if owner_id and task.get("user_id") != owner_id:
+                owner_index = owner_indexes[storage.shard_for_user(owner_id)]
+                owner_index.setdefault(owner_id, {})[task["id"]] = task.get("user_id")
+
+        for index, owner_index in enumerate(owner_indexes):
+            storage._write_json_file(storage.shard_owner_index_file(index), owner_index)
+        storage.save_tasks(tasks)
+        if storage.TASKS_FILE.exists():
+            storage.TASKS_FILE.replace(storage.TASKS_FILE.with_name(storage.TASKS_FILE.name + ".migrated"))
+    return len(tasks)
+
+
+if __name__ == "__main__":
+    try:
+        count = migrate_to_shards()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f"Migrated {count} tasks into {len(storage.SHARD_DIRS)} shards.")
@@ -1,24 +1,233 @@
 import json
+import os
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，改用 msvcrt 加锁
+    fcntl = None
+    import msvcrt
+
 DATA_DIR = Path("data")
 USERS_FILE = DATA_DIR / "users.json"
 TASKS_FILE = DATA_DIR / "tasks.json"
+AUDIO_DIR = Path("recordings")
+
+# 分片部署模式：TASK_SHARD_DIRS 为逗号分隔的分片根目录列表，未设置时为单机模式。
+# 任务按 user_id 划分分片，每个分片目录下包含：
+#   shard.json             分片布局（编号与总数），启动时校验
+#   data/tasks.json        user_id 落在该分片的任务
+#   data/owner_index.json  创建者 ID -> 其为他人创建、可能位于其他分片的任务
+#   recordings/            上述任务的录音文件
+# 用户数据（users.json）仍为全局共享，存放在 DATA_DIR 中。
+SHARD_DIRS = [Path(p.strip()) for p in os.environ.get("TASK_SHARD_DIRS", "").split(",") if p.strip()]
+
+
+def _read_json_file(path: Path, default=None):
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return [] if default is None else default
+
+
+def _write_json_file(path: Path, data):
+    """
+    先写入同目录下的临时文件，再通过 os.replace 原子替换，
+    避免其他进程读到写了一半的文件。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """
+    对 path 对应的 .lock 文件加排他锁，用于跨进程保护 读取→修改→保存 的完整过程。
+    """
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_path.open("a+") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
 
 
 def load_users():
-    if USERS_FILE.exists():
-        return json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    return []
+    return _read_json_file(USERS_FILE)
 
 def save_users(users):
-    USERS_FILE.write_text(json.dumps(users, indent=2, ensure_ascii=False), encoding="utf-8")
+    _write_json_file(USERS_FILE, users)
+
+
+def users_lock():
+    return _file_lock(USERS_FILE)
+
+
+def is_sharded() -> bool:
+    return bool(SHARD_DIRS)
+
+
+def shard_for_user(user_id) -> int:
+    """
+    根据任务的 user_id 计算分片编号。使用 crc32 保证多进程之间结果一致；
+    没有 user_id 的任务统一落在 0 号分片。
+    """
+    if not SHARD_DIRS or not user_id:
+        return 0
+    return zlib.crc32(str(user_id).encode("utf-8")) % len(SHARD_DIRS)
+
+
+def shard_layout_file(index: int) -> Path:
+    return SHARD_DIRS[index] / "shard.json"
+
+
+def shard_tasks_file(index: int) -> Path:
+    return SHARD_DIRS[index] / "data" / "tasks.json"
+
+
+def shard_owner_index_file(index: int) -> Path:
+    return SHARD_DIRS[index] / "data" / "owner_index.json"
+
+
+def check_shard_layout():
+    """
+    校验每个分片目录记录的布局与当前 TASK_SHARD_DIRS 一致，首次启动时写入布局。
+    分片数量或顺序变化会导致任务被路由到错误的分片，此时拒绝启动。
+    """
+    if not is_sharded():
+        return
+    total = len(SHARD_DIRS)
+    layouts = [_read_json_file(shard_layout_file(i), default={}) for i in range(total)]
+    for index, layout in enumerate(layouts):
+        if layout and layout != {"index": index, "total": total}:
+            raise RuntimeError(
+                f"Shard directory {SHARD_DIRS[index]} was created as shard "
+                f"{layout.get('index')} of {layout.get('total')}, but TASK_SHARD_DIRS "
+                f"now lists it as shard {index} of {total}."
+            )
+    if any(layouts) and not all(layouts):
+        missing = [str(SHARD_DIRS[i]) for i, layout in enumerate(layouts) if not layout]
+        raise RuntimeError(f"Shard directories {missing} were added to an existing shard layout.")
+    for index, layout in enumerate(layouts):
+        if not layout:
+            _write_json_file(shard_layout_file(index), {"index": index, "total": total})
+
+
+def tasks_lock(user_id=None):
+    """
+    获取任务文件锁。单机模式下锁定 tasks.json；分片模式下指定 user_id 时只锁定其所在分片，
+    未指定时按分片编号顺序锁定全部分片。
+    """
+    if not is_sharded():
+        return _file_lock(TASKS_FILE)
+    if user_id is not None:
+        return _file_lock(shard_tasks_file(shard_for_user(user_id)))
+    stack = ExitStack()
+    for index in range(len(SHARD_DIRS)):
+        stack.enter_context(_file_lock(shard_tasks_file(index)))
+    return stack
+
+
+def load_tasks(user_id=None):
+    """
+    加载任务列表。
+    单机模式下始终返回全部任务；分片模式下指定 user_id 时只读取其所在分片，
+    未指定时遍历所有分片并合并结果。
+    """
+    if not is_sharded():
+        return _read_json_file(TASKS_FILE)
+    if user_id is not None:
+        return _read_json_file(shard_tasks_file(shard_for_user(user_id)))
+    tasks = []
+    for index in range(len(SHARD_DIRS)):
+        tasks.extend(_read_json_file(shard_tasks_file(index)))
+    return tasks
+
+def save_tasks(tasks, user_id=None):
+    """
+    保存任务列表。
+    分片模式下指定 user_id 时整体写入其所在分片（tasks 应来自 load_tasks(user_id)）；
+    未指定时按每个任务的 user_id 重新划分并覆盖所有分片。
+    """
+    if not is_sharded():
+        _write_json_file(TASKS_FILE, tasks)
+        return
+    if user_id is not None:
+        _write_json_file(shard_tasks_file(shard_for_user(user_id)), tasks)
+        return
+    partitions = [[] for _ in SHARD_DIRS]
+    for task in tasks:
+        partitions[shard_for_user(task.get("user_id"))].append(task)
+    for index, shard_tasks in enumerate(partitions):
+        _write_json_file(shard_tasks_file(index), shard_tasks)
+
+
+def add_to_owner_index(owner_id: str, task_id: str, user_id):
+    """
+    记录 owner_id 为他人（user_id）创建的任务，使创建者无需遍历所有分片即可找到它。
+    索引保存在创建者所在分片，单机模式下不需要索引。
+    """
+    if not is_sharded():
+        return
+    index_file = shard_owner_index_file(shard_for_user(owner_id))
+    with _file_lock(index_file):
+        owner_index = _read_json_file(index_file, default={})
+        owner_index.setdefault(owner_id, {})[task_id] = user_id
+        _write_json_file(index_file, owner_index)
+
+
+def load_tasks_for_user(user_id: str):
+    """
+    加载某个用户可能有权访问的任务：其所在分片中的任务，加上索引中记录的、
+    由其创建但位于其他分片的任务。单机模式下返回全部任务，由调用方按权限过滤。
+    """
+    if not is_sharded():
+        return _read_json_file(TASKS_FILE)
+    own_shard = shard_for_user(user_id)
+    tasks = _read_json_file(shard_tasks_file(own_shard))
 
+    owner_index = _read_json_file(shard_owner_index_file(own_shard), default={}).get(user_id, {})
+    wanted = {}
+    for task_id, task_user_id in owner_index.items():
+        shard = shard_for_user(task_user_id)
+        if shard != own_shard:
+            wanted.setdefault(shard, set()).add(task_id)
+    for shard, task_ids in wanted.items():
+        tasks.extend(t for t in _read_json_file(shard_tasks_file(shard)) if t["id"] in task_ids)
+    return tasks
 
-def load_tasks():
-    if TASKS_FILE.exists():
-        return json.loads(TASKS_FILE.read_text(encoding="utf-8"))
-    return []
 
-def save_tasks(tasks):
-    TASKS_FILE.write_text(json.dumps(tasks, indent=2, ensure_ascii=False), encoding="utf-8")
\ No newline at end of file
+def get_audio_dir(user_id=None) -> Path:
+    """
+    返回存放录音文件的目录，分片模式下为 user_id 所在分片的 recordings/。
+    """
+    if not is_sharded():
+        return AUDIO_DIR
+    audio_dir = SHARD_DIRS[shard_for_user(user_id)] / "recordings"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    return audio_dir
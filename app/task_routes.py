@@ -2,9 +2,9 @@ from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query,
 from fastapi.responses import FileResponse, JSONResponse
 from .models import Task, User, TaskCreate, TaskUpdate, TaskStatus, AudioFile, AudioImportStatus
 from .utils import generate_id, now_iso
-from .storage import load_tasks, save_tasks
+from .storage import load_tasks, load_tasks_for_user, save_tasks, tasks_lock, add_to_owner_index, get_audio_dir, AUDIO_DIR
 from .auth import get_current_user
-from typing import Optional, List, Dict
+from typing import Callable, Optional, List, Dict
 from pathlib import Path
 import shutil
 import logging
@@ -30,7 +30,6 @@ if not logger.handlers:
     logger.addHandler(file_handler)
 
 router = APIRouter()
-AUDIO_DIR = Path("recordings")
 AUDIO_DIR.mkdir(exist_ok=True)
 
 MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50 MB
@@ -40,8 +39,9 @@ async def get_task_for_user(task_id: str, current_user: User = Depends(get_curre
     """
     依赖项：按ID获取任务，并验证当前用户是否有权访问。
     管理员可以访问任何任务，普通用户只能访问自己的任务。
+    分片模式下普通用户只查找自己所在分片及其创建索引中的任务，管理员遍历所有分片。
     """
-    tasks = load_tasks()
+    tasks = load_tasks() if current_user.role == "admin" else load_tasks_for_user(current_user.id)
     task = next((t for t in tasks if t["id"] == task_id), None)
 
     if not task:
@@ -56,6 +56,23 @@ async def get_task_for_user(task_id: str, current_user: User = Depends(get_curre
     return task
 
 
+def update_stored_task(task_id: str, user_id: Optional[str], apply: Callable[[Task], None]) -> Task:
+    """
+    在任务所在分片（由任务的 user_id 决定）的文件锁内重新读取任务，调用 apply 修改 Task 模型后写回。
+    """
+    with tasks_lock(user_id):
+        tasks = load_tasks(user_id)
+        task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
+        if task_index is None:
+            raise HTTPException(status_code=404, detail="Task not found.")
+
+        task_model = Task(**tasks[task_index])
+        apply(task_model)
+        tasks[task_index] = jsonable_encoder(task_model)
+        save_tasks(tasks, user_id)
+    return task_model
+
+
 @router.get("/tasks", response_model=List[Task])
 def get_tasks(
     current_user: User = Depends(get_current_user), 
@@ -65,12 +82,12 @@ def get_tasks(
     sort_order: Optional[str] = Query('asc', enum=['asc', 'desc'])
 ):
     logger.info(f"用户 {current_user.username} 正在获取任务列表，skip={skip}, limit={limit}, sort_by={sort_by}, sort_order={sort_order}。")
-    tasks = load_tasks()
-
     if current_user.role == "admin":
-        accessible_tasks = tasks
+        # 分片模式下遍历所有分片，合并后统一排序分页
+        accessible_tasks = load_tasks()
         logger.info(f"管理员 {current_user.username} 正在获取所有任务。")
     else:
+        tasks = load_tasks_for_user(current_user.id)
         accessible_tasks = [t for t in tasks if t.get("user_id") == current_user.id or t.get("owner") == current_user.username]
         logger.info(f"用户 {current_user.username} 获取到 {len(accessible_tasks)} 个任务。")
 
@@ -114,8 +131,6 @@ def get_task_by_id(task: dict = Depends(get_task_for_user)):
 @router.post("/tasks", response_model=Task, status_code=201)
 def create_task(task_data: TaskCreate, current_user: User = Depends(get_current_user)):
     logger.info(f"用户 {current_user.username} 正在创建新任务。")
-    tasks = load_tasks()
-    
     task_dict = task_data.dict(exclude_unset=True)  # 使用 exclude_unset=True 避免覆盖默认值
     if not task_dict.get('user_id'):
         task_dict['user_id'] = current_user.id
@@ -128,8 +143,14 @@ def create_task(task_data: TaskCreate, current_user: User = Depends(get_current_
         status=TaskStatus.PENDING
     )
     
-    tasks.append(new_task.dict())
-    save_tasks(tasks)
+    # 为他人创建的任务位于对方分片，先写入创建者的索引，保证创建者随后能查到
+    if new_task.user_id != current_user.id:
+        add_to_owner_index(current_user.id, new_task.id, new_task.user_id)
+
+    with tasks_lock(new_task.user_id):
+        tasks = load_tasks(new_task.user_id)
+        tasks.append(new_task.dict())
+        save_tasks(tasks, new_task.user_id)
     logger.info(f"任务 {new_task.id} 已由用户 {current_user.username} 成功创建。")
     return new_task
 
@@ -140,29 +161,32 @@ def update_task(update_data: TaskUpdate, task: dict = Depends(get_task_for_user)
     logger.info(f"用户 {current_user.username} 正在更新任务 {task_id}。")
 
     try:
-        tasks = load_tasks()
-        task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
+        with tasks_lock(task.get("user_id")):
+            tasks = load_tasks(task.get("user_id"))
+            task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
 
-        if task_index is None:
-            # 这个检查理论上是多余的，因为 get_task_for_user 已经处理了
-            raise HTTPException(status_code=404, detail="Task not found during update process.")
+            if task_index is None:
+                # 这个检查理论上是多余的，因为 get_task_for_user 已经处理了
+                raise HTTPException(status_code=404, detail="Task not found during update process.")
 
-        # 将存储的字典转换为 Pydantic 模型
-        task_model = Task(**tasks[task_index])
+            # 将存储的字典转换为 Pydantic 模型
+            task_model = Task(**tasks[task_index])
 
-        # 获取更新数据字典
-        update_dict = update_data.dict(exclude_unset=True)
+            # 获取更新数据字典
+            update_dict = update_data.dict(exclude_unset=True)
 
-        # 使用 Pydantic 的 copy 方法进行更新
-        updated_task_model = task_model.copy(update=update_dict)
-        
-        # 将更新后的模型转换为可序列化的字典
-        tasks[task_index] = jsonable_encoder(updated_task_model)
-        
-        save_tasks(tasks)
+            # 使用 Pydantic 的 copy 方法进行更新
+            updated_task_model = task_model.copy(update=update_dict)
+            
+            # 将更新后的模型转换为可序列化的字典
+            tasks[task_index] = jsonable_encoder(updated_task_model)
+            
+            save_tasks(tasks, task.get("user_id"))
         
         logger.info(f"任务 {task_id} 已由用户 {current_user.username} 成功更新。")
         return updated_task_model
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"更新任务 {task_id} 时发生内部错误: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error during task update.")
@@ -178,16 +202,15 @@ def upload_audio(
     task_id = task['id']
     logger.info(f"用户 {current_user.username} 正在为任务 {task_id} 上传文件。")
 
-    tasks = load_tasks()
-    task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
-    if task_index is None:
-        raise HTTPException(status_code=404, detail="Task not found during upload.")
+    task_user_id = task.get("user_id")
+
+    def set_import_status(status: AudioImportStatus):
+        def apply(task_model: Task):
+            task_model.audio_import_status = status
+        return apply
 
     # 更新任务状态为 IN_PROGRESS
-    task_model = Task(**tasks[task_index])
-    task_model.audio_import_status = AudioImportStatus.IN_PROGRESS
-    tasks[task_index] = jsonable_encoder(task_model)
-    save_tasks(tasks)
+    update_stored_task(task_id, task_user_id, set_import_status(AudioImportStatus.IN_PROGRESS))
 
     try:
         if user_filenames and len(user_filenames) != len(files):
@@ -212,7 +235,7 @@ def upload_audio(
 
             ext = Path(file.filename).suffix
             internal_filename = f"{task_id}_{uuid.uuid4()}{ext}"
-            dest_path = AUDIO_DIR / internal_filename
+            dest_path = get_audio_dir(task_user_id) / internal_filename
 
             try:
                 with dest_path.open("wb") as buffer:
@@ -227,22 +250,21 @@ def upload_audio(
                 user_filename=user_filename,
                 internal_path=str(dest_path)
             )
-            task_model.audio_files.append(audio_file_model)
             newly_added_files.append(audio_file_model)
 
-        # 更新任务状态为 COMPLETED
-        task_model.audio_import_status = AudioImportStatus.COMPLETED
-        tasks[task_index] = jsonable_encoder(task_model)
-        save_tasks(tasks)
+        # 文件写入完成后再加锁追加文件列表，并更新任务状态为 COMPLETED
+        def add_files(task_model: Task):
+            task_model.audio_files.extend(newly_added_files)
+            task_model.audio_import_status = AudioImportStatus.COMPLETED
+
+        update_stored_task(task_id, task_user_id, add_files)
 
         logger.info(f"为任务 {task_id} 成功上传 {len(newly_added_files)} 个文件。")
         return newly_added_files
 
     except Exception as e:
         # 更新任务状态为 FAILED
-        task_model.audio_import_status = AudioImportStatus.FAILED
-        tasks[task_index] = jsonable_encoder(task_model)
-        save_tasks(tasks)
+        update_stored_task(task_id, task_user_id, set_import_status(AudioImportStatus.FAILED))
         logger.error(f"为任务 {task_id} 上传文件时出错: {e}", exc_info=True)
         # 重新抛出异常，以便 FastAPI 处理
         raise e
@@ -257,80 +279,81 @@ def delete_audio_files(
     task_id = task['id']
     logger.info(f"用户 {current_user.username} 请求删除任务 {task_id} 的文件：{file_ids}")
 
-    tasks = load_tasks()
-    task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
-    if task_index is None:
-        logger.error(f"删除文件时未找到任务 {task_id}")
-        raise HTTPException(status_code=404, detail="Task not found.")
-
-    task_model = Task(**tasks[task_index])
-    if not task_model.audio_files:
-        logger.warning(f"任务 {task_id} 没有音频文件")
-        raise HTTPException(status_code=404, detail="Task has no audio files.")
-
-    # 验证所有要删除的文件ID是否存在
-    existing_file_ids = {f.id for f in task_model.audio_files}
-    invalid_file_ids = set(file_ids) - existing_file_ids
-    if invalid_file_ids:
-        logger.warning(f"请求删除的文件ID不存在：{invalid_file_ids}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid file IDs: {list(invalid_file_ids)}"
-        )
+    with tasks_lock(task.get("user_id")):
+        tasks = load_tasks(task.get("user_id"))
+        task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
+        if task_index is None:
+            logger.error(f"删除文件时未找到任务 {task_id}")
+            raise HTTPException(status_code=404, detail="Task not found.")
 
-    # 准备删除操作
-    files_to_delete = [f for f in task_model.audio_files if f.id in file_ids]
-    files_to_keep = [f for f in task_model.audio_files if f.id not in file_ids]
-    deletion_results = []
-    failed_deletions = []
+        task_model = Task(**tasks[task_index])
+        if not task_model.audio_files:
+            logger.warning(f"任务 {task_id} 没有音频文件")
+            raise HTTPException(status_code=404, detail="Task has no audio files.")
+
+        # 验证所有要删除的文件ID是否存在
+        existing_file_ids = {f.id for f in task_model.audio_files}
+        invalid_file_ids = set(file_ids) - existing_file_ids
+        if invalid_file_ids:
+            logger.warning(f"请求删除的文件ID不存在：{invalid_file_ids}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file IDs: {list(invalid_file_ids)}"
+            )
 
-    # 执行文件删除
-    for file in files_to_delete:
-        try:
-            file_path = Path(file.internal_path)
-            if file_path.is_file():
-                file_path.unlink()
-                deletion_results.append({
-                    "id": file.id,
-                    "filename": file.user_filename,
-                    "status": "success"
-                })
-                logger.info(f"成功删除文件：{file.user_filename} (ID: {file.id})")
-            else:
-                logger.warning(f"文件不存在于磁盘：{file.internal_path}")
-                deletion_results.append({
+        # 准备删除操作
+        files_to_delete = [f for f in task_model.audio_files if f.id in file_ids]
+        files_to_keep = [f for f in task_model.audio_files if f.id not in file_ids]
+        deletion_results = []
+        failed_deletions = []
+
+        # 执行文件删除
+        for file in files_to_delete:
+            try:
+                file_path = Path(file.internal_path)
+                if file_path.is_file():
+                    file_path.unlink()
+                    deletion_results.append({
+                        "id": file.id,
+                        "filename": file.user_filename,
+                        "status": "success"
+                    })
+                    logger.info(f"成功删除文件：{file.user_filename} (ID: {file.id})")
+                else:
+                    logger.warning(f"文件不存在于磁盘：{file.internal_path}")
+                    deletion_results.append({
+                        "id": file.id,
+                        "filename": file.user_filename,
+                        "status": "file_not_found"
+                    })
+            except Exception as e:
+                logger.error(f"删除文件 {file.internal_path} 失败: {str(e)}", exc_info=True)
+                failed_deletions.append({
                     "id": file.id,
                     "filename": file.user_filename,
-                    "status": "file_not_found"
+                    "error": str(e)
                 })
-        except Exception as e:
-            logger.error(f"删除文件 {file.internal_path} 失败: {str(e)}", exc_info=True)
-            failed_deletions.append({
-                "id": file.id,
-                "filename": file.user_filename,
-                "error": str(e)
-            })
-
-    # 更新任务数据
-    task_model.audio_files = files_to_keep
-    tasks[task_index] = jsonable_encoder(task_model)
+
+        # 更新任务数据
+        task_model.audio_files = files_to_keep
+        tasks[task_index] = jsonable_encoder(task_model)
     
-    try:
-        save_tasks(tasks)
-        logger.info(f"已更新任务 {task_id} 的文件列表")
-    except Exception as e:
-        logger.error(f"保存任务数据时发生错误: {str(e)}", exc_info=True)
-        # 如果保存失败，尝试恢复已删除的文件
-        for result in deletion_results:
-            if result["status"] == "success":
-                file_to_restore = next(
-                    f for f in files_to_delete if f.id == result["id"]
-                )
-                logger.warning(f"正在尝试恢复已删除的文件：{file_to_restore.user_filename}")
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to save task data after file deletion."
-        )
+        try:
+            save_tasks(tasks, task.get("user_id"))
+            logger.info(f"已更新任务 {task_id} 的文件列表")
+        except Exception as e:
+            logger.error(f"保存任务数据时发生错误: {str(e)}", exc_info=True)
+            # 如果保存失败，尝试恢复已删除的文件
+            for result in deletion_results:
+                if result["status"] == "success":
+                    file_to_restore = next(
+                        f for f in files_to_delete if f.id == result["id"]
+                    )
+                    logger.warning(f"正在尝试恢复已删除的文件：{file_to_restore.user_filename}")
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to save task data after file deletion."
+            )
 
     response_data = {
         "message": "File deletion completed",
@@ -355,17 +378,18 @@ def rename_audio_file(
     current_user: User = Depends(get_current_user)
 ):
     task_id = task['id']
-    tasks = load_tasks()
-    task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
-    task_model = Task(**tasks[task_index])
+    with tasks_lock(task.get("user_id")):
+        tasks = load_tasks(task.get("user_id"))
+        task_index = next((i for i, t in enumerate(tasks) if t["id"] == task_id), None)
+        task_model = Task(**tasks[task_index])
 
-    file_to_rename = next((f for f in task_model.audio_files if f.id == file_id), None)
-    if not file_to_rename:
-        raise HTTPException(status_code=404, detail="File not found.")
+        file_to_rename = next((f for f in task_model.audio_files if f.id == file_id), None)
+        if not file_to_rename:
+            raise HTTPException(status_code=404, detail="File not found.")
 
-    file_to_rename.user_filename = new_filename
-    tasks[task_index] = jsonable_encoder(task_model)
-    save_tasks(tasks)
+        file_to_rename.user_filename = new_filename
+        tasks[task_index] = jsonable_encoder(task_model)
+        save_tasks(tasks, task.get("user_id"))
 
     logger.info(f"用户 {current_user.username} 已将任务 {task_id} 的文件 {file_id} 重命名为 {new_filename}。")
     return file_to_rename
@@ -412,11 +436,10 @@ def search_tasks(
 ):
     logger.info(f"用户 {current_user.username} 正在根据条件搜索任务: keyword={keyword}, priority={priority}, status={status}, category={category}, tags={tags}, owner={owner}, created_after={created_after}, created_before={created_before}")
     
-    tasks = load_tasks()
-
     if current_user.role == "admin":
-        accessible_tasks = tasks
+        accessible_tasks = load_tasks()
     else:
+        tasks = load_tasks_for_user(current_user.id)
         accessible_tasks = [t for t in tasks if t.get("user_id") == current_user.id or t.get("owner") == current_user.username]
 
     def task_filter(task: dict) -> bool:
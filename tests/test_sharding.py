@@ -0,0 +1,228 @@
+import json
+import multiprocessing
+import zlib
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+USERS = [
+    {"id": "id-admin", "username": "admin", "password_hash": "x", "role": "admin"},
+    {"id": "id-user1", "username": "user1", "password_hash": "x", "role": "user"},
+    {"id": "id-radial", "username": "radial", "password_hash": "x", "role": "user"},
+    {"id": "id-bob", "username": "bob", "password_hash": "x", "role": "user"},
+]
+
+SHARD_COUNT = 4
+
+
+def make_task(task_id, owner, user_id, created_at, title=None):
+    return {
+        "id": task_id,
+        "title": title or task_id,
+        "description": "",
+        "priority": "medium",
+        "status": "pending",
+        "owner": owner,
+        "user_id": user_id,
+        "category": "未分类",
+        "tags": [],
+        "created_at": created_at,
+        "audio_files": [],
+        "transcription": None,
+    }
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from app import storage
+
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    users_file = data_dir / "users.json"
+    users_file.write_text(json.dumps(USERS), encoding="utf-8")
+    monkeypatch.setattr(storage, "USERS_FILE", users_file)
+    monkeypatch.setattr(storage, "TASKS_FILE", data_dir / "tasks.json")
+    monkeypatch.setattr(storage, "SHARD_DIRS", [tmp_path / "shards" / str(i) for i in range(SHARD_COUNT)])
+    return storage
+
+
+@pytest.fixture
+def client(storage):
+    from app.main import app
+    return TestClient(app)
+
+
+def auth(username):
+    from app.auth import create_access_token
+    return {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+
+
+def test_shard_for_user_uses_crc32(storage):
+    for user_id in ("id-admin", "id-user1", "id-radial", "string"):
+        assert storage.shard_for_user(user_id) == zlib.crc32(user_id.encode("utf-8")) % SHARD_COUNT
+    assert storage.shard_for_user(None) == 0
+
+
+def test_save_tasks_splits_by_user_id(storage):
+    tasks = [make_task(f"t-{user_id}", "admin", user_id, "2025-01-01T00:00:00") for user_id in ("id-admin", "id-user1", "id-radial")]
+    storage.save_tasks(tasks)
+
+    for index in range(SHARD_COUNT):
+        shard_tasks = json.loads(storage.shard_tasks_file(index).read_text(encoding="utf-8"))
+        assert all(storage.shard_for_user(t["user_id"]) == index for t in shard_tasks)
+    assert sorted(t["id"] for t in storage.load_tasks()) == ["t-id-admin", "t-id-radial", "t-id-user1"]
+    assert [t["id"] for t in storage.load_tasks("id-user1")] == ["t-id-user1"]
+
+
+def test_single_node_mode_unchanged(storage, monkeypatch):
+    monkeypatch.setattr(storage, "SHARD_DIRS", [])
+    tasks = [make_task("t1", "bob", "id-bob", "2025-01-01T00:00:00")]
+    storage.save_tasks(tasks, "id-bob")
+
+    assert json.loads(storage.TASKS_FILE.read_text(encoding="utf-8")) == tasks
+    assert storage.load_tasks_for_user("id-user1") == tasks
+    assert storage.get_audio_dir("id-bob") == storage.AUDIO_DIR
+
+
+def test_layout_mismatch_refuses_to_start(storage, tmp_path, monkeypatch):
+    two_shards = [tmp_path / "layout" / name for name in ("a", "b")]
+    monkeypatch.setattr(storage, "SHARD_DIRS", two_shards)
+    storage.check_shard_layout()
+    storage.save_tasks([
+        make_task("z", "admin", "zed", "2025-01-01T00:00:00"),
+        make_task("y", "admin", "amy", "2025-01-01T00:00:00"),
+    ])
+    storage.check_shard_layout()
+
+    # 增加分片后 amy 的任务会被路由到新分片，必须拒绝启动
+    monkeypatch.setattr(storage, "SHARD_DIRS", two_shards + [tmp_path / "layout" / "c"])
+    with pytest.raises(RuntimeError):
+        storage.check_shard_layout()
+
+    monkeypatch.setattr(storage, "SHARD_DIRS", list(reversed(two_shards)))
+    with pytest.raises(RuntimeError):
+        storage.check_shard_layout()
+
+    monkeypatch.setattr(storage, "SHARD_DIRS", two_shards[:1])
+    with pytest.raises(RuntimeError):
+        storage.check_shard_layout()
+
+
+def test_user_routes_to_own_shard_and_owner_index(storage, client):
+    assert storage.shard_for_user("id-user1") != storage.shard_for_user("id-radial")
+    storage.save_tasks([
+        # 由 user1 创建、分配给 radial，位于 radial 的分片
+        make_task("assigned", "user1", "id-radial", "2025-01-01T00:00:00"),
+        make_task("foreign", "user1", "id-user1", "2025-01-03T00:00:00"),
+    ])
+    storage.add_to_owner_index("id-user1", "assigned", "id-radial")
+    # radial 为 user1 创建的任务位于 user1 的分片，通过创建者索引找到
+    response = client.post("/tasks", json={"title": "for user1", "user_id": "id-user1"}, headers=auth("radial"))
+    assert response.status_code == 201
+    created = response.json()["id"]
+    assert created in [t["id"] for t in storage.load_tasks("id-user1")]
+
+    listed = client.get("/tasks", headers=auth("radial")).json()
+    assert [t["id"] for t in listed] == ["assigned", created]
+
+    searched = client.get("/tasks/search/", headers=auth("radial")).json()
+    assert sorted(t["id"] for t in searched) == sorted(["assigned", created])
+
+    assert client.get("/tasks/assigned", headers=auth("radial")).status_code == 200
+    assert client.get(f"/tasks/{created}", headers=auth("radial")).status_code == 200
+    assert client.get("/tasks/foreign", headers=auth("radial")).status_code == 404
+    assert client.get("/tasks/foreign", headers=auth("admin")).status_code == 200
+
+    user1_listed = client.get("/tasks", headers=auth("user1")).json()
+    assert sorted(t["id"] for t in user1_listed) == sorted(["assigned", "foreign", created])
+
+
+def test_create_task_with_arbitrary_user_id_stays_visible(storage, client):
+    response = client.post("/tasks", json={"title": "new", "user_id": "string"}, headers=auth("user1"))
+    assert response.status_code == 201
+    task_id = response.json()["id"]
+
+    assert [t["id"] for t in storage.load_tasks("string")] == [task_id]
+    assert [t["id"] for t in client.get("/tasks", headers=auth("user1")).json()] == [task_id]
+
+
+def test_admin_listing_merges_sorts_and_paginates(storage, client):
+    storage.save_tasks([
+        make_task("t3", "bob", "id-bob", "2025-01-03T00:00:00"),
+        make_task("t1", "user1", "id-user1", "2025-01-01T00:00:00"),
+        make_task("t4", "radial", "id-radial", "2025-01-04T00:00:00"),
+        make_task("t2", "admin", "id-admin", "2025-01-02T00:00:00"),
+    ])
+
+    response = client.get("/tasks", params={"sort_order": "desc", "skip": 1, "limit": 2}, headers=auth("admin"))
+    assert [t["id"] for t in response.json()] == ["t3", "t2"]
+
+
+def test_update_writes_to_task_shard(storage, client):
+    response = client.post("/tasks", json={"title": "for user1", "user_id": "id-user1"}, headers=auth("radial"))
+    task_id = response.json()["id"]
+
+    response = client.put(f"/tasks/{task_id}", json={"status": "approved"}, headers=auth("radial"))
+    assert response.status_code == 200
+    assert storage.load_tasks("id-user1")[0]["status"] == "approved"
+    assert storage.load_tasks("id-radial") == []
+
+
+def test_upload_goes_to_shard_recordings(storage, client):
+    storage.save_tasks([make_task("t1", "bob", "id-bob", "2025-01-01T00:00:00")])
+
+    response = client.post("/tasks/t1/files/upload", files={"files": ("a.wav", b"data")}, headers=auth("bob"))
+    assert response.status_code == 200
+    internal_path = Path(response.json()[0]["internal_path"])
+    assert internal_path.parent == storage.SHARD_DIRS[storage.shard_for_user("id-bob")] / "recordings"
+    assert internal_path.read_bytes() == b"data"
+
+    stored = storage.load_tasks("id-bob")[0]
+    assert stored["audio_import_status"] == "completed"
+    assert [f["internal_path"] for f in stored["audio_files"]] == [str(internal_path)]
+
+
+def test_migration_builds_owner_index_and_refuses_rerun(storage):
+    from app import migrate_shards
+
+    tasks = [
+        make_task("own", "radial", "id-radial", "2025-01-01T00:00:00"),
+        make_task("created", "radial", "string", "2025-01-02T00:00:00"),
+    ]
+    storage.TASKS_FILE.write_text(json.dumps(tasks), encoding="utf-8")
+
+    assert migrate_shards.migrate_to_shards() == 2
+    assert sorted(t["id"] for t in storage.load_tasks()) == ["created", "own"]
+    assert sorted(t["id"] for t in storage.load_tasks_for_user("id-radial")) == ["created", "own"]
+    assert not storage.TASKS_FILE.exists()
+    assert storage.TASKS_FILE.with_name("tasks.json.migrated").exists()
+
+    storage.TASKS_FILE.write_text(json.dumps(tasks), encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        migrate_shards.migrate_to_shards()
+
+
+def _append_tasks(shard_dirs, user_id, count):
+    from app import storage
+
+    storage.SHARD_DIRS = shard_dirs
+    for i in range(count):
+        with storage.tasks_lock(user_id):
+            tasks = storage.load_tasks(user_id)
+            tasks.append(make_task(f"{user_id}-{i}", "admin", user_id, "2025-01-01T00:00:00"))
+            storage.save_tasks(tasks, user_id)
+
+
+def test_concurrent_processes_do_not_lose_writes(storage):
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_append_tasks, args=(storage.SHARD_DIRS, user_id, 30)) for user_id in ("id-radial", "id-bob")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # id-radial 与 id-bob 位于同一分片，两个进程争用同一个 tasks.json
+    assert storage.shard_for_user("id-radial") == storage.shard_for_user("id-bob")
+    assert len(storage.load_tasks("id-radial")) == 60